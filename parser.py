@@ -5,14 +5,20 @@ import re
 import os
 import argparse
 
+# ERC20 addresses: '0x' followed by 40 hexadecimal characters.
+# Compiled once so the per-tweet scan skips the re module's pattern cache.
+# The literal '0x' prefix lets the regex engine jump between candidates with a
+# C substring search, so a hand-written scanner would not beat it from Python.
+_ERC_RE = re.compile(r'0x[a-fA-F0-9]{40}')
+_ERC_SEARCH = _ERC_RE.search
+
 def extract_erc_address(text):
     """
     Finds and extracts the first ERC20 cryptocurrency address from text.
     ERC20 addresses follow the pattern: '0x' followed by 40 hexadecimal characters.
     Example: 0x71C7656EC7ab88b098defB751B7401B5f6d8976F
     """
-    # Regular expression pattern matching for ERC20 addresses
-    match = re.search(r'0x[a-fA-F0-9]{40}', text)
+    match = _ERC_SEARCH(text)
     return match.group(0) if match else None
 
 def process_csv(input_path, output_path):
@@ -24,55 +30,82 @@ def process_csv(input_path, output_path):
     3. Extracts unique addresses from tweets
     4. Writes cleaned data to new CSV
     """
-    with open(input_path, 'r', encoding='utf-8-sig') as f:  # Handle BOM if present
-        reader = csv.DictReader(f)  # Read as dictionary for column access
+    # Handle BOM if present; newline='' lets csv handle line breaks inside quoted
+    # tweets, and a 1 MiB buffer cuts read() syscalls on large exports
+    with open(input_path, 'r', encoding='utf-8-sig', newline='',
+              buffering=1 << 20) as f:
+        reader = csv.reader(f)  # Plain rows are much cheaper than a dict per row
+        header = next(reader, [])
         
         # Debug output to help identify column mismatch issues
-        print("Detected columns:", reader.fieldnames)
+        print("Detected columns:", header)
         
         # Ensure CSV contains all required columns for processing
         required_columns = ['ID', 'Name', 'Handle', 'TweetText', 
                           'TweetCreateTime', 'TweetURL']
         missing_columns = [col for col in required_columns 
-                         if col not in reader.fieldnames]
+                         if col not in header]
         if missing_columns:
             print(f"Error: Missing required columns: {', '.join(missing_columns)}")
             sys.exit(1)
+        
+        # Resolve column positions once instead of looking up names per row
+        idx = {col: header.index(col) for col in required_columns}
             
-        output_rows = []
         # Simplified output columns (exclude long text fields for readability)
         keep_columns = ['ID', 'Handle', 'TweetCreateTime', 'TweetURL']
         
         # Track unique addresses to avoid duplicates
         seen_addresses = set()
+        written_count = 0
         duplicate_count = 0
         
-        for row in reader:
-            tweet_text = row['TweetText']
-            if tweet_text:
-                # Attempt to find crypto address in tweet text
-                if address := extract_erc_address(tweet_text):
-                    # Only add new unique addresses
-                    if address not in seen_addresses:
-                        seen_addresses.add(address)
-                        # Create simplified record with essential info
-                        new_entry = {col: row[col] for col in keep_columns}
-                        new_entry['Address'] = address
-                        output_rows.append(new_entry)
-                    else:
-                        duplicate_count += 1
+        # Stream results to a temporary file instead of buffering every row; it only
+        # replaces output_path once there is something to write, so an existing file
+        # (or the input itself) is never truncated by a run that finds nothing
+        tmp_path = f"{output_path}.tmp"
+        text_idx = idx['TweetText']
+        keep_idx = tuple(idx[col] for col in keep_columns)
+        min_len = max(idx.values()) + 1
+        try:
+            with open(tmp_path, 'w', newline='', encoding='utf-8') as out_f:
+                writer = csv.writer(out_f)
+                writer.writerow(keep_columns + ['Address'])  # Column headers
+                
+                for row in reader:
+                    # Skip blank lines and truncated rows missing required fields
+                    if len(row) < min_len:
+                        continue
+                    tweet_text = row[text_idx]
+                    if tweet_text:
+                        # Attempt to find crypto address in tweet text
+                        if address := extract_erc_address(tweet_text):
+                            # Dedupe on the raw 20 address bytes: a smaller set entry than the
+                            # 42-char string, and case-insensitive since mixed case is only a checksum
+                            key = bytes.fromhex(address[2:])
+                            # Only add new unique addresses
+                            if key not in seen_addresses:
+                                seen_addresses.add(key)
+                                # Write simplified record with essential info
+                                new_entry = [row[i] for i in keep_idx]
+                                new_entry.append(address)
+                                writer.writerow(new_entry)
+                                written_count += 1
+                            else:
+                                duplicate_count += 1
+        except BaseException:
+            # Don't leave a partial temporary file behind on errors or Ctrl+C
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
 
-    if output_rows:
-        # Write results to new CSV file
-        with open(output_path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=keep_columns + ['Address'])
-            writer.writeheader()  # Column headers
-            writer.writerows(output_rows)  # Actual data
-            
-        print(f"Successfully wrote {len(output_rows)} records to {output_path}")
+    if written_count:
+        os.replace(tmp_path, output_path)
+        print(f"Successfully wrote {written_count} records to {output_path}")
         print(f"Unique addresses found: {len(seen_addresses)}")
         print(f"Duplicate addresses skipped: {duplicate_count}")
     else:
+        os.remove(tmp_path)
         print("No valid ERC20 addresses found in input data")
 
 def main():
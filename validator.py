@@ -4,75 +4,190 @@
 # Imported libraries breakdown:
 # - argparse: Handles command-line arguments for input/output files
 # - aiohttp: Enables fast asynchronous HTTP requests to blockchain node
+# - aiolimiter: Token-bucket rate limiting to respect API throughput limits
 # - asyncio: Manages concurrency for high-performance address checking
 # - csv: Reads input addresses and writes validated results
-# - datetime: Converts blockchain timestamps to human-readable format
+# - re: Checks address format before querying the API
+# - orjson: Fast JSON encoding/decoding for API requests and responses
+# - calendar: Converts blockchain timestamps to Unix time
 # - dotenv: Loads environment variables from .env file
+# - tenacity: Retries rate-limited requests with exponential backoff
+# - uvloop: Drop-in libuv-based event loop, used when installed
 import argparse
 import aiohttp
+from aiolimiter import AsyncLimiter
 import asyncio
 import csv
-import json
-from datetime import datetime
+import orjson
+from calendar import timegm
 import os
+import re
+import sys
 from dotenv import load_dotenv
+from tenacity import (retry, retry_if_exception_type, stop_after_attempt,
+                      wait_exponential_jitter)
 
-async def get_funding(session, semaphore, row, api_key):
-    """Checks if an address received initial funding through Alchemy's blockchain API.
-    
-    Uses semaphore to prevent overwhelming the API with too many concurrent requests.
-    Processes one address at a time with error handling for reliability."""
-    
-    async with semaphore:  # Limits concurrent requests (max 50 at once)
-        try:
-            # API request payload formatted for Alchemy's specific JSON-RPC requirements
-            payload = json.dumps({
-                "id": 1,
-                "jsonrpc": "2.0",
-                "method": "alchemy_getAssetTransfers",
-                "params": [{
-                    "toAddress": row['Address'],  # The cryptocurrency address to check
-                    "category": ["external"],     # Only look at external transactions (not internal)
-                    "order": "asc",               # Get earliest transaction first
-                    "maxCount": "0x1",            # Only need the first transaction
-                    "withMetadata": True          # Include block timestamp information
-                }]
-            })
-
-            # Send the API request using our connection pool
-            async with session.post(
-                f"https://arb-mainnet.g.alchemy.com/v2/{api_key}",
-                data=payload,
-                headers={'Content-Type': 'application/json'}
-            ) as response:
-                data = await response.json()
-                
-                # Successful response will contain 'result' with transfer data
-                if 'result' in data and data['result']['transfers']:
-                    transfer = data['result']['transfers'][0]  # Get first transaction
-                    
-                    # Convert blockchain timestamp to Unix format for easier analysis
-                    timestamp = int(datetime.fromisoformat(
-                        transfer['metadata']['blockTimestamp'].replace('Z', '+00:00')
-                    ).timestamp())
-                    
-                    # Return enriched address data with funding details
-                    return {
-                        **row,  # Preserve original data
-                        'funded': True,
-                        'firstTxHash': transfer['hash'],  # Transaction ID on blockchain
-                        'funder': transfer['from'],       # Address that sent funds
-                        'timestamp': timestamp,           # When funding occurred
-                        'block': int(transfer['blockNum'], 16)  # Blockchain block number
-                    }
-                # Add rate limit cushion (50ms delay after each successful call)
-                # Insurance against rate limits, more info https://docs.alchemy.com/reference/throughput
-                await asyncio.sleep(0.05)
-                return {**row, 'funded': False}
-        except Exception as e:
-            print(f"Error processing address {row['Address']}: {e}")
-            # Safely handle any API errors by marking as unfunded
-            return {**row, 'funded': False}
+try:
+    import uvloop  # Faster event loop; not available on Windows
+except ImportError:
+    uvloop = None
+
+# Number of addresses sent per JSON-RPC batch request (one HTTP POST each)
+BATCH_SIZE = 50
+
+# Address lookups allowed per second; tune to your Alchemy plan's throughput
+# (batches shrink to this size if it is below BATCH_SIZE)
+# More info https://docs.alchemy.com/reference/throughput
+MAX_LOOKUPS_PER_SECOND = 300
+
+# Number of worker tasks pulling batches from the queue (max batches in flight)
+WORKER_COUNT = 20
+
+# JSON-RPC error codes Alchemy uses when the throughput limit is exceeded
+RATE_LIMIT_CODES = (429, -32005)
+
+# Well-formed address: '0x' followed by exactly 40 hexadecimal characters
+_ADDR_RE = re.compile(r'0x[0-9a-fA-F]{40}')
+
+# Query parameters shared by every lookup; only 'toAddress' changes per address
+_PARAMS_TMPL = {
+    "category": ["external"],     # Only look at external transactions (not internal)
+    "order": "asc",               # Get earliest transaction first
+    "maxCount": "0x1",            # Only need the first transaction
+    "withMetadata": True          # Include block timestamp information
+}
+
+def _json_dumps(obj):
+    """Serializes request bodies with orjson (aiohttp expects a str, orjson gives bytes)."""
+    return orjson.dumps(obj).decode()
+
+def parse_transfer(row, item):
+    """Turns one JSON-RPC response item into the funding result for its row."""
+    # Successful response will contain 'result' with transfer data
+    if 'result' in item and item['result']['transfers']:
+        transfer = item['result']['transfers'][0]  # Get first transaction
+        
+        # Convert blockchain timestamp to Unix format for easier analysis.
+        # Alchemy always returns "YYYY-MM-DDTHH:MM:SS.sssZ" (UTC), so the fields
+        # sit at fixed offsets and can be read without a general ISO parser.
+        ts = transfer['metadata']['blockTimestamp']
+        timestamp = timegm((int(ts[0:4]), int(ts[5:7]), int(ts[8:10]),
+                            int(ts[11:13]), int(ts[14:16]), int(ts[17:19]), 0, 0, 0))
+        
+        # Return original row alongside its funding details
+        return {
+            'row': row,  # Original CSV fields, in input column order
+            'funded': True,
+            'firstTxHash': transfer['hash'],  # Transaction ID on blockchain
+            'funder': transfer['from'],       # Address that sent funds
+            'timestamp': timestamp,           # When funding occurred
+            'block': int(transfer['blockNum'], 16)  # Blockchain block number
+        }
+    return {'row': row, 'funded': False}
+
+class RateLimited(Exception):
+    """Raised when Alchemy rejects a request for exceeding the throughput limit."""
+    
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after  # Seconds the server asked us to wait, if any
+
+def is_rate_limit_error(error):
+    """Checks whether a JSON-RPC error object is Alchemy's rate-limit response."""
+    return isinstance(error, dict) and error.get('code') in RATE_LIMIT_CODES
+
+_backoff = wait_exponential_jitter(initial=1, max=30)
+
+def _retry_wait(retry_state):
+    """Waits as long as the server asked (Retry-After), else backs off exponentially."""
+    retry_after = getattr(retry_state.outcome.exception(), 'retry_after', None)
+    return retry_after if retry_after is not None else _backoff(retry_state)
+
+@retry(retry=retry_if_exception_type(RateLimited), wait=_retry_wait,
+       stop=stop_after_attempt(5), reraise=True)
+async def post_batch(session, limiter, payload, api_key):
+    """Sends one JSON-RPC batch and returns the decoded response list.
+    
+    Rate-limited attempts raise RateLimited and are retried with backoff; each
+    attempt takes its own tokens from the limiter."""
+    
+    # Wait until the rate budget has room for every lookup in this batch
+    await limiter.acquire(len(payload))
+    
+    # Send the API request using our connection pool (the session serializes it)
+    async with session.post(
+        f"https://arb-mainnet.g.alchemy.com/v2/{api_key}",
+        json=payload
+    ) as response:
+        if response.status == 429:
+            retry_after = response.headers.get('Retry-After', '')
+            raise RateLimited("HTTP 429 Too Many Requests",
+                              int(retry_after) if retry_after.isdigit() else None)
+        data = orjson.loads(await response.read())
+    
+    # A failed batch comes back as a single error object instead of a list
+    if not isinstance(data, list):
+        error = data.get('error', data) if isinstance(data, dict) else data
+        if is_rate_limit_error(error):
+            raise RateLimited(error.get('message', error))
+        raise ValueError(error)
+    
+    # Individual lookups can be rate limited too; retry the batch as a whole
+    for item in data:
+        if is_rate_limit_error(item.get('error')):
+            raise RateLimited(item['error'].get('message', item['error']))
+    return data
+
+async def get_funding(session, limiter, rows, address_idx, api_key):
+    """Checks if addresses received initial funding through Alchemy's blockchain API.
+    
+    Sends one JSON-RPC batch request per chunk of rows, so a single HTTP round-trip
+    covers up to BATCH_SIZE addresses. Uses a token-bucket limiter (one token per
+    address) to stay within the API throughput budget. Rows are plain CSV rows with
+    the address at position address_idx. Returns one result per input row; 'funded'
+    is None when the request failed (e.g. stayed rate limited) and the address could
+    not be verified."""
+    
+    try:
+        # API request payload formatted for Alchemy's specific JSON-RPC requirements.
+        # The request id is the row's position in the batch, used to match responses.
+        payload = [{
+            "id": i,
+            "jsonrpc": "2.0",
+            "method": "alchemy_getAssetTransfers",
+            "params": [{**_PARAMS_TMPL, "toAddress": row[address_idx]}]
+        } for i, row in enumerate(rows)]
+        
+        data = await post_batch(session, limiter, payload, api_key)
+        
+        # Batch responses may arrive in any order, so match them up by id
+        items = {item.get('id'): item for item in data}
+        results = []
+        for i, row in enumerate(rows):
+            item = items.get(i)
+            if item is None:
+                # No answer for this address; don't mistake that for "unfunded"
+                print(f"Error processing address {row[address_idx]}: missing from batch response")
+                results.append({'row': row, 'funded': None})
+                continue
+            if 'error' in item:
+                print(f"Error processing address {row[address_idx]}: {item['error']}")
+            try:
+                results.append(parse_transfer(row, item))
+            except Exception as e:
+                # A malformed item only affects its own address, not the batch
+                print(f"Error processing address {row[address_idx]}: {e}")
+                results.append({'row': row, 'funded': False})
+        return results
+    except RateLimited as e:
+        print(f"Rate limited on batch of {len(rows)} addresses after retries: {e}")
+        # Not a verdict on these addresses, so report them as unverified
+        return [{'row': row, 'funded': None} for row in rows]
+    except Exception as e:
+        print(f"Error processing batch of {len(rows)} addresses: {e}")
+        # A failed request (network error, bad response body) says nothing about
+        # the addresses either, so they are reported as unverified too
+        return [{'row': row, 'funded': None} for row in rows]
 
 async def main():
     """Orchestrates the validation process with progress tracking and result output."""
@@ -85,63 +200,124 @@ async def main():
                        help='Optional output path for results (default: input_funded.csv)')
     args = parser.parse_args()
 
-    # Read all addresses at once for batch processing
-    with open(args.input_file, 'r') as f:
-        reader = csv.DictReader(f)
-        original_fields = reader.fieldnames  # Preserve original CSV structure
-        rows = list(reader)  # Load all data into memory for parallel processing
+    # Read all addresses at once for batch processing (large buffer, as in parser.py)
+    with open(args.input_file, 'r', encoding='utf-8-sig', newline='',
+              buffering=1 << 20) as f:
+        reader = csv.reader(f)  # Columns are accessed by position below
+        original_fields = next(reader, [])  # Preserve original CSV structure
+        
+        if 'Address' not in original_fields:
+            print("Error: Missing required column: Address")
+            sys.exit(1)
+        # Resolve the address position once instead of looking it up by name per row
+        address_idx = original_fields.index('Address')
+        
+        # Load all data into memory for parallel processing
+        # (blank lines and truncated rows without an address are skipped)
+        rows = [row for row in reader if len(row) > address_idx]
+    
+    # Malformed addresses can never be funded, so drop them before spending
+    # a network round-trip on each one
+    valid_rows = [row for row in rows if _ADDR_RE.fullmatch(row[address_idx])]
+    if len(valid_rows) < len(rows):
+        print(f"Skipping {len(rows) - len(valid_rows)} malformed addresses")
+    rows = valid_rows
 
-    # Get API key from environment variables for security
-    api_key = os.getenv('ALCHEMY_API_KEY')
+    # Get API keys from environment variables for security. Alchemy rate-limits
+    # per key, so extra keys (ALCHEMY_API_KEY_2, ...) add throughput. Repeated values
+    # are dropped so a key never gets more than one limiter.
+    api_keys = list(dict.fromkeys(value for name, value in sorted(os.environ.items())
+                                  if name.startswith('ALCHEMY_API_KEY') and value))
+    if not api_keys:
+        print("Error: ALCHEMY_API_KEY is not set")
+        sys.exit(1)
     
-    # Create concurrency limiter (20 concurrent requests max)
-    semaphore = asyncio.Semaphore(20)
+    # Create one rate limiter per key (token bucket refilled at MAX_LOOKUPS_PER_SECOND)
+    endpoints = [(AsyncLimiter(MAX_LOOKUPS_PER_SECOND, 1), api_key)
+                 for api_key in api_keys]
     
     print(f"Starting validation for {len(rows)} addresses...")
     
-    # Create HTTP session with connection pooling
-    async with aiohttp.ClientSession() as session:
-        # Create all validation tasks up front
-        tasks = [get_funding(session, semaphore, row, api_key) for row in rows]
-        
-        # Progress tracking setup
-        completed = 0
-        start_time = asyncio.get_event_loop().time()
-        results = []
-        
-        # Process results as they complete (out-of-order OK)
-        for future in asyncio.as_completed(tasks):
-            result = await future
-            results.append(result)
-            completed += 1
-            
-            # Progress updates every 100 addresses
-            if completed % 100 == 0 or completed == len(rows):
-                elapsed = asyncio.get_event_loop().time() - start_time
-                req_per_sec = completed / elapsed if elapsed > 0 else 0
-                print(f"Processed {completed}/{len(rows)} addresses "
-                      f"({req_per_sec:.1f}/sec)")
-
-    # Filter and analyze results
-    funded = [result for result in results if result['funded']]
-    print(f"Found {len(funded)} funded addresses ({len(funded)/len(rows):.1%})")
-    
     # Output structure adds blockchain transaction ID to original data
     fieldnames = original_fields + ['firstTxHash']
     
     # Generate output path: input_funded.csv if none specified
     output_path = args.output_file or f"{os.path.splitext(args.input_file)[0]}_funded.csv"
+    
+    # Create HTTP session with connection pooling (bounded number of sockets).
+    # Every request goes to the same Alchemy host, so keep connections alive
+    # and cache its DNS entry for the whole run to avoid repeated TLS handshakes.
+    connector = aiohttp.TCPConnector(limit=100, limit_per_host=100,
+                                     ttl_dns_cache=600, keepalive_timeout=60)
+    # Funded addresses are written as soon as they are confirmed, so nothing
+    # accumulates in memory and an interrupted run still leaves partial output
+    with open(output_path, 'w', newline='', encoding='utf-8') as out_f:
+        writer = csv.writer(out_f)
+        writer.writerow(fieldnames)
+        
+        async with aiohttp.ClientSession(connector=connector,
+                                         json_serialize=_json_dumps) as session:
+            # Queue every batch of addresses; a fixed pool of workers drains it,
+            # so only WORKER_COUNT requests are ever scheduled at once
+            queue = asyncio.Queue()
+            # A batch takes one token per address, so it can't exceed the bucket size
+            batch_size = min(BATCH_SIZE, MAX_LOOKUPS_PER_SECOND)
+            # Batches are spread round-robin over the available API keys
+            for n, i in enumerate(range(0, len(rows), batch_size)):
+                queue.put_nowait((rows[i:i + batch_size], endpoints[n % len(endpoints)]))
+            
+            # Progress tracking setup
+            completed = 0
+            funded_count = 0
+            unverified = []  # Rows whose lookup failed (e.g. still rate limited)
+            start_time = asyncio.get_event_loop().time()
+            
+            async def worker():
+                """Validates queued batches until none are left."""
+                nonlocal completed, funded_count
+                while not queue.empty():
+                    batch, (limiter, api_key) = queue.get_nowait()
+                    batch_results = await get_funding(session, limiter, batch,
+                                                     address_idx, api_key)
+                    
+                    # Process results as they complete (out-of-order OK)
+                    for result in batch_results:
+                        if result['funded']:
+                            writer.writerow(result['row'] + [result['firstTxHash']])
+                            funded_count += 1
+                        elif result['funded'] is None:
+                            unverified.append(result['row'])
+                    previous = completed
+                    completed += len(batch_results)
+                    
+                    # Progress updates every 100 addresses
+                    if completed // 100 != previous // 100 or completed == len(rows):
+                        elapsed = asyncio.get_event_loop().time() - start_time
+                        req_per_sec = completed / elapsed if elapsed > 0 else 0
+                        print(f"Processed {completed}/{len(rows)} addresses "
+                              f"({req_per_sec:.1f}/sec)")
+            
+            await asyncio.gather(*(worker() for _ in range(WORKER_COUNT)))
 
-    # Write validated results with new transaction ID column
-    with open(output_path, 'w', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        # Automatically filters extra fields from API response
-        writer.writerows({k: v for k, v in row.items() if k in fieldnames} 
-                        for row in funded)
-
-    print(f"Wrote {len(funded)} funded addresses to {output_path}")
+    funded_share = funded_count / len(rows) if rows else 0  # All rows may have been skipped
+    print(f"Found {funded_count} funded addresses ({funded_share:.1%})")
+    print(f"Wrote {funded_count} funded addresses to {output_path}")
+    
+    # Addresses whose lookup failed were never checked; keep them separate so they can be
+    # re-run instead of silently counting as unfunded, and fail the run
+    if unverified:
+        unverified_path = f"{os.path.splitext(output_path)[0]}_unverified.csv"
+        with open(unverified_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(original_fields)
+            writer.writerows(unverified)
+        print(f"Error: {len(unverified)} addresses could not be verified, "
+              f"wrote them to {unverified_path}")
+        sys.exit(1)
 
 if __name__ == "__main__":
-    # Start the async event loop
-    asyncio.run(main())
\ No newline at end of file
+    # Start the async event loop (uvloop's if available, else the stdlib one)
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
\ No newline at end of file